@@ -0,0 +1,239 @@
+import os
+import math
+import hashlib
+import time
+import asyncio
+import collections
+from fastapi.responses import JSONResponse
+
+# Cost in capacity tokens per route. Routes that fan out to Perplexity,
+# MailTester or the embedding model weigh more than cheap lookups; cost 0
+# bypasses admission entirely.
+ROUTE_COSTS = {
+    "/health": 0,
+    "/metrics": 0,
+    "/search": 2,
+    "/verify-email": 3,
+    "/analyze-company": 10,
+    "/generate-email": 8,
+    "/send-email": 2,
+    "/import-leads": 20,
+}
+DEFAULT_ROUTE_COST = 1
+
+# Maximum concurrent in-flight requests per route, across all tenants
+ROUTE_CONCURRENCY = {
+    "/analyze-company": 8,
+    "/generate-email": 8,
+    "/verify-email": 16,
+    "/import-leads": 2,
+}
+
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", 64))
+ADMISSION_TENANT_CAPACITY = int(os.getenv("ADMISSION_TENANT_CAPACITY", 24))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 100))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 10.0))
+# Comma-separated API keys that get their own tenant; anything else is keyed by address
+ADMISSION_API_KEYS = [key.strip() for key in os.getenv("ADMISSION_API_KEYS", "").split(",") if key.strip()]
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Cost-weighted admission with per-tenant limits and a fair wait queue
+
+    Each request takes `cost` tokens from a global budget and from its
+    tenant's budget, plus one slot of its route's concurrency limit. Requests
+    that don't fit wait in a per-tenant queue; freed capacity is handed out
+    round-robin across tenants so one large batch can't starve everyone
+    else. When the queue is full, or a request waits too long, it is
+    rejected with a Retry-After estimate.
+    """
+
+    def __init__(self, capacity=ADMISSION_CAPACITY, tenant_capacity=ADMISSION_TENANT_CAPACITY,
+                 queue_size=ADMISSION_QUEUE_SIZE, queue_timeout=ADMISSION_QUEUE_TIMEOUT,
+                 route_costs=ROUTE_COSTS, route_concurrency=ROUTE_CONCURRENCY):
+        self.capacity = capacity
+        self.tenant_capacity = tenant_capacity
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.route_costs = route_costs
+        self.route_concurrency = route_concurrency
+        self._in_use = 0
+        self._tenant_in_use = collections.Counter()
+        self._route_in_flight = collections.Counter()
+        self._waiters = collections.OrderedDict()  # tenant -> deque of (future, cost, route)
+        self._queued = 0
+        self._avg_service_seconds = 1.0
+        self._avg_cost = float(DEFAULT_ROUTE_COST)
+        self._counters = collections.Counter()
+
+    def cost(self, route):
+        cost = self.route_costs.get(route, DEFAULT_ROUTE_COST)
+        return min(cost, self.capacity, self.tenant_capacity)
+
+    def _fits(self, tenant, cost, route):
+        limit = self.route_concurrency.get(route)
+        return (
+            self._in_use + cost <= self.capacity
+            and self._tenant_in_use[tenant] + cost <= self.tenant_capacity
+            and (limit is None or self._route_in_flight[route] < limit)
+        )
+
+    def _take(self, tenant, cost, route):
+        self._in_use += cost
+        self._tenant_in_use[tenant] += cost
+        self._route_in_flight[route] += 1
+
+    def retry_after(self):
+        """Rough seconds until capacity frees up, for the Retry-After header"""
+        concurrent_slots = max(1.0, self.capacity / max(1.0, self._avg_cost))
+        return max(1, math.ceil((self._queued + 1) / concurrent_slots * self._avg_service_seconds))
+
+    async def acquire(self, tenant, route):
+        cost = self.cost(route)
+        if cost == 0:
+            return 0
+        if not self._waiters and self._fits(tenant, cost, route):
+            self._take(tenant, cost, route)
+            self._counters["admitted"] += 1
+            return cost
+        if self._queued >= self.queue_size:
+            self._counters["rejected_queue_full"] += 1
+            raise AdmissionRejected("queue full", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, cost, route)
+        self._waiters.setdefault(tenant, collections.deque()).append(waiter)
+        self._queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted just as the timeout fired; keep the slot
+                return cost
+            self._remove_waiter(tenant, waiter)
+            self._counters["rejected_timeout"] += 1
+            raise AdmissionRejected("queue timeout", self.retry_after())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(tenant, route, cost, 0.0)
+            else:
+                self._remove_waiter(tenant, waiter)
+            raise
+        self._counters["admitted_after_wait"] += 1
+        return cost
+
+    def release(self, tenant, route, cost, service_seconds):
+        if cost == 0:
+            return
+        self._in_use -= cost
+        self._tenant_in_use[tenant] -= cost
+        if not self._tenant_in_use[tenant]:
+            del self._tenant_in_use[tenant]
+        self._route_in_flight[route] -= 1
+        self._avg_service_seconds = 0.9 * self._avg_service_seconds + 0.1 * service_seconds
+        self._avg_cost = 0.9 * self._avg_cost + 0.1 * cost
+        self._dispatch()
+
+    def _remove_waiter(self, tenant, waiter):
+        queue = self._waiters.get(tenant)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            self._queued -= 1
+            if not queue:
+                del self._waiters[tenant]
+
+    def _dispatch(self):
+        """Grant queued requests round-robin across tenants while they fit"""
+        granted = True
+        while granted and self._waiters:
+            granted = False
+            for tenant in list(self._waiters):
+                queue = self._waiters[tenant]
+                future, cost, route = queue[0]
+                if not self._fits(tenant, cost, route):
+                    continue
+                queue.popleft()
+                self._queued -= 1
+                self._take(tenant, cost, route)
+                future.set_result(True)
+                # Served tenant moves to the back of the rotation
+                del self._waiters[tenant]
+                if queue:
+                    self._waiters[tenant] = queue
+                granted = True
+
+    def metrics(self):
+        return {
+            "capacity": self.capacity,
+            "in_use": self._in_use,
+            "queued": self._queued,
+            "tenants_waiting": len(self._waiters),
+            "route_in_flight": {route: count for route, count in self._route_in_flight.items() if count},
+            **self._counters
+        }
+
+
+def _key_digest(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+# Known keys by digest, so lookups don't compare raw secrets and metrics never show them
+_known_api_keys = {_key_digest(key): f"key:{_key_digest(key)[:12]}" for key in ADMISSION_API_KEYS}
+
+
+def tenant_for(request):
+    """Tenant key: a known API key, falling back to client address
+
+    Unknown keys are ignored so a client can't mint fresh tenants (and fresh
+    per-tenant capacity) by sending random X-API-Key values.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key:
+        tenant = _known_api_keys.get(_key_digest(api_key))
+        if tenant:
+            return tenant
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+async def admission_middleware(controller, request, call_next):
+    """HTTP middleware body: admit, run the handler, release when the body is sent"""
+    route = request.url.path
+    if request.method == "OPTIONS":
+        return await call_next(request)
+    tenant = tenant_for(request)
+    try:
+        cost = await controller.acquire(tenant, route)
+    except AdmissionRejected as e:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": f"Too many requests ({e.reason})"},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+    start = time.monotonic()
+    try:
+        response = await call_next(request)
+    except BaseException:
+        controller.release(tenant, route, cost, time.monotonic() - start)
+        raise
+
+    # Hold the slot until the (possibly streamed) body has been sent
+    body_iterator = response.body_iterator
+
+    async def release_after_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            controller.release(tenant, route, cost, time.monotonic() - start)
+
+    response.body_iterator = release_after_body()
+    return response
@@ -1,15 +1,42 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import uvicorn
 from typing import List, Optional
 import logging
+import asyncio
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+import resilience
+import admission
+import lead_import
+from sender_pool import SenderPool
+from fast_response import fast_json_response, dumps
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Sales AI Agent API", version="1.0.0")
+# Multi-mailbox sending is enabled by SENDER_MAILBOXES / SENDER_MAILBOXES_FILE.
+# Built at startup rather than import, so spawned worker processes that
+# re-import this module don't decrypt passwords or touch the quota database.
+sender_pool = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global sender_pool
+    sender_pool = await asyncio.to_thread(SenderPool.from_env)
+    yield
+
+app = FastAPI(title="Sales AI Agent API", version="1.0.0", lifespan=lifespan)
+admission_controller = admission.AdmissionController()
+
+# Admission control (registered before CORS so 429s still carry CORS headers)
+@app.middleware("http")
+async def admission_control(request, call_next):
+    return await admission.admission_middleware(admission_controller, request, call_next)
 
 # CORS configuration
 app.add_middleware(
@@ -67,8 +94,18 @@ class EmailContent(BaseModel):
 async def health_check():
     return {"status": "healthy", "service": "Sales AI Agent API"}
 
+@app.get("/metrics")
+async def metrics():
+    return {
+        "upstreams": resilience.metrics(),
+        "admission": admission_controller.metrics(),
+        "senders": sender_pool.stats() if sender_pool else []
+    }
+
+# List endpoints keep response_model for the OpenAPI schema but return a
+# pre-encoded response, so per-item Pydantic validation is skipped
 @app.post("/search", response_model=List[SearchResult])
-async def search_companies(request: SearchRequest):
+async def search_companies(request: SearchRequest, http_request: Request):
     # Mock implementation - replace with actual search logic
     mock_results = [
         {
@@ -78,7 +115,7 @@ async def search_companies(request: SearchRequest):
         }
         for i in range(min(request.limit, 5))
     ]
-    return mock_results
+    return fast_json_response(http_request, mock_results)
 
 @app.post("/verify-email", response_model=EmailVerification)
 async def verify_email(request: EmailVerificationRequest):
@@ -90,6 +127,52 @@ async def verify_email(request: EmailVerificationRequest):
         "status": "verified"
     }
 
+@app.post("/import-leads")
+async def import_leads(file: UploadFile = File(...), verify: bool = False):
+    """Stream a CSV/XLSX lead file back as NDJSON, one line per new lead
+
+    The last line is {"summary": {...}} with row, duplicate and invalid counts;
+    if the file turns out to be malformed part-way through, an {"error": ...}
+    line precedes it.
+    """
+    if not file.filename.lower().endswith((".csv", ".xlsx", ".xlsm")):
+        raise HTTPException(status_code=400, detail="Upload a .csv or .xlsx file")
+
+    # The upload is closed once this handler returns, before the body streams,
+    # so hand the generator its own copy to read from and close
+    upload = tempfile.TemporaryFile()
+    stats = {}
+    try:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, upload)
+        upload.seek(0)
+        leads = lead_import.import_leads(upload, file.filename, verify=verify, stats=stats)
+        # Pull the first lead off the event loop so header/format errors surface as a 400
+        first = await asyncio.to_thread(next, leads, None)
+    except ValueError as e:
+        upload.close()
+        raise HTTPException(status_code=400, detail=str(e))
+    except BaseException:
+        upload.close()
+        raise
+
+    def ndjson():
+        try:
+            if first is not None:
+                yield dumps(first) + b"\n"
+                try:
+                    for lead in leads:
+                        yield dumps(lead) + b"\n"
+                except lead_import.LeadFileError as e:
+                    # Headers were already sent, so report it in-band
+                    logger.warning(f"Lead import of {file.filename} stopped: {e}")
+                    yield dumps({"error": str(e)}) + b"\n"
+            yield dumps({"summary": stats}) + b"\n"
+        finally:
+            leads.close()
+            upload.close()
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 @app.post("/analyze-company", response_model=CompanyAnalysis)
 async def analyze_company(request: CompanyAnalysisRequest):
     # Mock implementation - replace with actual AI analysis
@@ -149,6 +232,17 @@ async def generate_email(request: EmailGenerationRequest):
 
 @app.post("/send-email")
 async def send_email(email_data: dict):
+    if sender_pool is not None:
+        if not email_data.get('to'):
+            raise HTTPException(status_code=400, detail="Missing recipient")
+        sender = await asyncio.to_thread(
+            sender_pool.send,
+            email_data['to'],
+            email_data.get('subject', ''),
+            email_data.get('body') or email_data.get('html_content', '')
+        )
+        return {"status": "sent", "message": f"Email sent from {sender}"}
+
     # Mock implementation - replace with actual email sending logic
     logger.info(f"Mock sending email to: {email_data.get('to', 'unknown')}")
     return {"status": "sent", "message": "Email sent successfully (mock)"}
@@ -0,0 +1,54 @@
+"""Micro-benchmark: per-item serialization cost of list responses
+
+Compares FastAPI's default path (response_model validation, jsonable_encoder,
+stdlib json) with fast_response.dumps, plus the cost of gzip/zstd on top.
+
+    python bench_serialization.py [items]
+"""
+import sys
+import json
+import time
+from typing import List
+from pydantic import TypeAdapter
+from fastapi.encoders import jsonable_encoder
+import fast_response
+from app import SearchResult
+
+
+def bench(label, fn, items, repeat=5):
+    best = min(_time(fn) for _ in range(repeat))
+    print(f"{label:<36} {best * 1e3:8.2f} ms total {best / items * 1e6:8.2f} us/item")
+    return best
+
+
+def _time(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    items = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rows = [
+        {
+            "title": f"Company Result {i} - VP Sales at Example Corp",
+            "snippet": f"Snippet {i}: leads sales operations for a mid-size SaaS company in the logistics space.",
+            "link": f"https://www.linkedin.com/in/example-person-{i}"
+        }
+        for i in range(items)
+    ]
+    adapter = TypeAdapter(List[SearchResult])
+
+    def default_path():
+        # What FastAPI does for response_model=List[SearchResult] + JSONResponse
+        validated = adapter.validate_python(rows)
+        return json.dumps(jsonable_encoder(validated), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    body = fast_response.dumps(rows)
+    print(f"{items} items, {len(body)} bytes encoded (orjson: {fast_response.orjson is not None})")
+    baseline = bench("response_model + json", default_path, items)
+    fast = bench("fast_response.dumps", lambda: fast_response.dumps(rows), items)
+    bench("fast_response.dumps + gzip", lambda: fast_response.compress(fast_response.dumps(rows), "gzip"), items)
+    if fast_response.zstandard is not None:
+        bench("fast_response.dumps + zstd", lambda: fast_response.compress(fast_response.dumps(rows), "zstd"), items)
+    print(f"speedup (encode only): {baseline / fast:.1f}x, gzip size {len(fast_response.compress(body, 'gzip'))} bytes")
@@ -1,13 +1,219 @@
-from transformers import pipeline
+"""Long-lived local text generation with dynamic batching
 
-# Ensure transformers library is updated
-import subprocess
-import sys
+Loads a (small, CPU-friendly) causal LM once and serves concurrent
+chat_completion calls from a single worker thread. Requests arriving within
+LOCAL_LLM_MAX_WAIT_MS of each other are batched together; within a batch,
+prompts are grouped by length so padding stays small.
 
-subprocess.check_call([sys.executable, "-m", "pip", "install", "--upgrade", "transformers"])
+Responses use the same shape as info_gather.chat_completion (Perplexity):
+{"choices": [{"message": {"role": "assistant", "content": ...}}], "usage": {...}}
 
-messages = [
-    {"role": "user", "content": "Who are you?"},
-]
-pipe = pipeline("text-generation", model="deepseek-ai/DeepSeek-V3", trust_remote_code=True)
-pipe(messages)
\ No newline at end of file
+Benchmark on a CPU-only box:
+    python deepseek.py --requests 16 --tokens 64
+"""
+import os
+import time
+import queue
+import threading
+import concurrent.futures
+
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "Qwen/Qwen2.5-0.5B-Instruct")
+# Dynamic int8 quantization of Linear layers; CPU only
+LOCAL_LLM_QUANTIZE = os.getenv("LOCAL_LLM_QUANTIZE", "false").lower() in ("1", "true", "yes")
+LOCAL_LLM_MAX_BATCH_SIZE = int(os.getenv("LOCAL_LLM_MAX_BATCH_SIZE", 8))
+LOCAL_LLM_MAX_WAIT_MS = float(os.getenv("LOCAL_LLM_MAX_WAIT_MS", 20))
+# Prompts whose token lengths differ by more than this go in separate sub-batches
+LOCAL_LLM_PADDING_BUCKET = int(os.getenv("LOCAL_LLM_PADDING_BUCKET", 64))
+LOCAL_LLM_THREADS = int(os.getenv("LOCAL_LLM_THREADS", os.cpu_count() or 1))
+
+
+class _GenerationRequest:
+    def __init__(self, messages, max_tokens, streamer=None):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.streamer = streamer
+        self.future = concurrent.futures.Future()
+        self.input_ids = None
+
+
+class LocalGenerator:
+    """Local chat model behind the chat_completion interface"""
+
+    def __init__(self, model_name=LOCAL_LLM_MODEL, quantize=LOCAL_LLM_QUANTIZE,
+                 max_batch_size=LOCAL_LLM_MAX_BATCH_SIZE, max_wait_ms=LOCAL_LLM_MAX_WAIT_MS,
+                 padding_bucket=LOCAL_LLM_PADDING_BUCKET):
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        torch.set_num_threads(LOCAL_LLM_THREADS)
+        self.torch = torch
+        self.model_name = model_name
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        # Left padding keeps every prompt's last token aligned for generation
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        model = AutoModelForCausalLM.from_pretrained(model_name)
+        model.eval()
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.model = model
+
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.padding_bucket = padding_bucket
+        self._queue = queue.Queue()
+        self._carry = None
+        self._stats = {"requests": 0, "batches": 0}
+        self._worker = threading.Thread(target=self._run, name="local-llm", daemon=True)
+        self._worker.start()
+
+    def chat_completion(self, messages, tokens):
+        """Blocking generation; returns a Perplexity-shaped response dict"""
+        request = _GenerationRequest(messages, tokens)
+        self._queue.put(request)
+        return request.future.result()
+
+    def stream(self, messages, tokens):
+        """Yield generated text incrementally (streamed requests are not batched)"""
+        from transformers import TextIteratorStreamer
+
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        request = _GenerationRequest(messages, tokens, streamer=streamer)
+        self._queue.put(request)
+        for text in streamer:
+            if text:
+                yield text
+        request.future.result()  # surface generation errors
+
+    def stats(self):
+        stats = dict(self._stats)
+        stats["avg_batch_size"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def _prompt(self, messages):
+        if getattr(self.tokenizer, "chat_template", None):
+            return self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        return "\n".join(f"{m['role']}: {m['content']}" for m in messages) + "\nassistant:"
+
+    def _collect_batch(self):
+        """Block for one request, then gather more until the wait window closes"""
+        first = self._carry or self._queue.get()
+        self._carry = None
+        if first.streamer is not None:
+            return [first]
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request.streamer is not None:
+                self._carry = request
+                break
+            batch.append(request)
+        return batch
+
+    def _sub_batches(self, batch):
+        """Group by prompt length so each generate() call pads as little as possible"""
+        for request in batch:
+            request.input_ids = self.tokenizer(self._prompt(request.messages), add_special_tokens=False)["input_ids"]
+        batch.sort(key=lambda r: len(r.input_ids))
+        group = []
+        for request in batch:
+            if group and len(request.input_ids) - len(group[0].input_ids) > self.padding_bucket:
+                yield group
+                group = []
+            group.append(request)
+        if group:
+            yield group
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                for group in self._sub_batches(batch):
+                    self._generate(group)
+            except Exception as e:
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+                    if request.streamer is not None:
+                        request.streamer.end()
+
+    def _generate(self, group):
+        inputs = self.tokenizer.pad({"input_ids": [r.input_ids for r in group]}, return_tensors="pt")
+        max_new_tokens = max(r.max_tokens for r in group)
+        with self.torch.inference_mode():
+            output = self.model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.pad_token_id,
+                streamer=group[0].streamer
+            )
+        self._stats["requests"] += len(group)
+        self._stats["batches"] += 1
+
+        prompt_width = inputs["input_ids"].shape[1]
+        for request, row in zip(group, output):
+            completion = row[prompt_width:prompt_width + request.max_tokens].tolist()
+            if self.tokenizer.eos_token_id in completion:
+                completion = completion[:completion.index(self.tokenizer.eos_token_id)]
+            content = self.tokenizer.decode(completion, skip_special_tokens=True)
+            request.future.set_result({
+                "model": self.model_name,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                "usage": {
+                    "prompt_tokens": len(request.input_ids),
+                    "completion_tokens": len(completion),
+                    "total_tokens": len(request.input_ids) + len(completion)
+                }
+            })
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def get_local_generator():
+    """Process-wide LocalGenerator, loaded on first use"""
+    global _generator
+    with _generator_lock:
+        if _generator is None:
+            _generator = LocalGenerator()
+        return _generator
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the local generator")
+    parser.add_argument("--requests", type=int, default=16)
+    parser.add_argument("--tokens", type=int, default=64)
+    args = parser.parse_args()
+
+    generator = get_local_generator()
+    messages = [
+        [{"role": "user", "content": f"Write a one-line cold email opener for prospect #{i}."}]
+        for i in range(args.requests)
+    ]
+
+    start = time.perf_counter()
+    sequential = [generator.chat_completion(messages[0], args.tokens)]
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.requests) as executor:
+        results = list(executor.map(lambda m: generator.chat_completion(m, args.tokens), messages))
+    batched = time.perf_counter() - start
+
+    completion_tokens = sum(r["usage"]["completion_tokens"] for r in results)
+    print(f"model={generator.model_name} quantized={LOCAL_LLM_QUANTIZE}")
+    print(f"single request: {single:.2f}s ({sequential[0]['usage']['completion_tokens']} tokens)")
+    print(f"{args.requests} concurrent: {batched:.2f}s, {completion_tokens / batched:.1f} tokens/s, stats={generator.stats()}")
+    print(results[0]["choices"][0]["message"]["content"])
@@ -4,6 +4,13 @@ import os
 import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+import time
+import threading
+
+# MX lookups are cached per sender domain; MX records rarely change
+SMTP_SERVER_CACHE_TTL = int(os.getenv("SMTP_SERVER_CACHE_TTL", 6 * 3600))
+_smtp_server_cache = {}
+_smtp_server_cache_lock = threading.Lock()
 
 def identify_smtp_server(email: str) -> tuple:
     # Extract the domain from the email address.
@@ -11,7 +18,18 @@ def identify_smtp_server(email: str) -> tuple:
         domain = email.split('@')[-1].lower()
     except IndexError:
         raise HTTPException(status_code=400, detail="Invalid email format")
-    
+
+    with _smtp_server_cache_lock:
+        cached = _smtp_server_cache.get(domain)
+    if cached and time.time() - cached[1] < SMTP_SERVER_CACHE_TTL:
+        return cached[0]
+
+    smtp_info = _resolve_smtp_server(domain)
+    with _smtp_server_cache_lock:
+        _smtp_server_cache[domain] = (smtp_info, time.time())
+    return smtp_info
+
+def _resolve_smtp_server(domain: str) -> tuple:
     # Mapping from substrings (found in MX records) to SMTP server settings.
     # For example, if the MX record contains 'google.com' then we assume the provider is Gmail.
     known_mx_map = {
@@ -42,33 +60,37 @@ def identify_smtp_server(email: str) -> tuple:
     # If no known key is found in the MX records, return a default SMTP server.
     return ("smtpout.secureserver.net", 587)
 
-def send_notification_email(to_email: str, subject: str, body: str, smtp_server: str):
+def send_notification_email(to_email: str, subject: str, body: str, smtp_server: str,
+                            username: str = None, password: str = None, smtp_port: int = 587):
+    username = username or os.getenv('EMAIL_USERNAME')
+    password = password or os.getenv('EMAIL_PASSWORD')
     msg = MIMEMultipart()
-    msg['From'] = os.getenv('EMAIL_USERNAME')
+    msg['From'] = username
     msg['To'] = to_email
     msg['Subject'] = subject
     msg.attach(MIMEText(body, 'html'))
 
     try:
-        with smtplib.SMTP(smtp_server, 587) as server:
+        with smtplib.SMTP(smtp_server, smtp_port) as server:
             server.ehlo()
             server.starttls()
             server.ehlo()
-            server.login(os.getenv('EMAIL_USERNAME'), os.getenv('EMAIL_PASSWORD'))
-            server.sendmail(os.getenv('EMAIL_USERNAME'), to_email, msg.as_string())
+            server.login(username, password)
+            server.sendmail(username, to_email, msg.as_string())
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error sending email: {e}")
 
 # Example usage:
-smtp_server, smtp_port = identify_smtp_server("dharani@leadagent.in")
-print(smtp_server, smtp_port)
+if __name__ == "__main__":
+    smtp_server, smtp_port = identify_smtp_server("dharani@leadagent.in")
+    print(smtp_server, smtp_port)
 
-send_notification_email(
-    to_email="dharani96556@gmail.com",
-    subject="Test Email",
-    body="This is a test email.",
-    smtp_server=smtp_server
-    # smtp_server="smtp.gmail.com"
-)
+    send_notification_email(
+        to_email="dharani96556@gmail.com",
+        subject="Test Email",
+        body="This is a test email.",
+        smtp_server=smtp_server
+        # smtp_server="smtp.gmail.com"
+    )
 
-print("Email sent successfully.")
+    print("Email sent successfully.")
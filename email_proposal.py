@@ -1,16 +1,40 @@
-import PyPDF2
-import re
+import asyncio
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
 import json
+import os
+import copy
+import hashlib
 from info_gather import chat_completion
+from semantic_cache import SemanticCache, can_mask, mask_fields, unmask_fields
+from offload import EncodeBatcher, run_in_threads, run_in_processes
+from pdf_templates import extract_templates_from_pdf
 
 class EmailProposalSystem:
-    def __init__(self, pdf_paths):
+    def __init__(self, pdf_paths, templates=None):
         self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.templates = self._load_all_templates(pdf_paths)
+        self.templates = templates if templates is not None else self._load_all_templates(pdf_paths)
         self._create_faiss_index()
+        self.encode_batcher = EncodeBatcher(self.model)
+        self.response_cache = SemanticCache(
+            self.model,
+            threshold=float(os.getenv("EMAIL_CACHE_THRESHOLD", 0.95)),
+            edit_threshold=float(os.getenv("EMAIL_CACHE_EDIT_THRESHOLD", 0.88)),
+            max_entries=int(os.getenv("EMAIL_CACHE_MAX_ENTRIES", 1000)),
+            ttl_seconds=int(os.getenv("EMAIL_CACHE_TTL_SECONDS", 86400))
+        )
+
+    @classmethod
+    async def create(cls, pdf_paths):
+        """Build the system from async code without blocking the event loop
+
+        PDFs are parsed in parallel worker processes; model loading and
+        template embedding run on the CPU thread pool.
+        """
+        categories = list(pdf_paths)
+        parsed = await asyncio.gather(*(run_in_processes(extract_templates_from_pdf, pdf_paths[c]) for c in categories))
+        return await run_in_threads(cls, pdf_paths, dict(zip(categories, parsed)))
 
     def _load_all_templates(self, pdf_paths):
         """Load and structure templates from multiple PDFs"""
@@ -21,74 +45,20 @@ class EmailProposalSystem:
 
     def _extract_templates_from_pdf(self, pdf_path):
         """Extract numbered templates from a single PDF with error handling"""
-        try:
-            print(f"Processing PDF: {pdf_path}")  # Debug statement
-            with open(pdf_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                full_text = '\n'.join([page.extract_text() for page in reader.pages])
-                print(f"Extracted text from PDF:\n{full_text}")  # Debug statement
-
-            # Preprocess the text: Replace multiple spaces and newlines with a single space
-            full_text = re.sub(r'\s+', ' ', full_text).strip()
-
-            # Improved regex pattern to match numbered templates
-            # Matches patterns like "1. Template Title" or "1.  Template Title" or "2. “I Feel Like a Stalker”"
-            pattern = r'(\b\d+\.\s+“?[A-Za-z].+?”?)(?=\b\d+\.\s+“?[A-Za-z]|\Z)'
-            sections = re.split(pattern, full_text)
-
-            templates = []
-            current_title = None
-            current_content = ""
-
-            for i, section in enumerate(sections):
-                if re.match(r'\b\d+\.\s+“?[A-Za-z].+?”?', section.strip()):
-                    # Found new template title
-                    if current_title:
-                        # Add previous template if exists
-                        templates.append({
-                            'title': current_title.strip(),
-                            'content': current_content.strip(),
-                            'embedding': None
-                        })
-                    current_title = section.strip()
-                    current_content = ""
-                elif current_title:
-                    # Accumulate content under current title
-                    current_content += section.strip() + " "
-
-            # Add the last template
-            if current_title and current_content:
-                templates.append({
-                    'title': current_title.strip(),
-                    'content': current_content.strip(),
-                    'embedding': None
-                })
-
-            if not templates:
-                print(f"No templates found in {pdf_path}")  # Debug statement
-
-            print(f"Found {len(templates)} templates in {pdf_path}:")  # Debug statement
-            for i, template in enumerate(templates, 1):
-                print(f"Template {i}: {template['title']}")  # Debug statement
-
-            return templates
-
-        except Exception as e:
-            print(f"Error processing {pdf_path}: {str(e)}")
-            return []
+        return extract_templates_from_pdf(pdf_path)
 
     def _create_faiss_index(self):
         """Create unified FAISS index for all templates"""
         all_embeddings = []
         self.template_list = []
 
-        # Flatten templates and create embeddings
+        # Flatten templates and embed them in a single batched encode
         for category in self.templates:
-            for template in self.templates[category]:
-                embedding = self.model.encode(template['title'] + " " + template['content'])
+            self.template_list.extend(self.templates[category])
+        if self.template_list:
+            all_embeddings = list(self.model.encode([t['title'] + " " + t['content'] for t in self.template_list]))
+            for template, embedding in zip(self.template_list, all_embeddings):
                 template['embedding'] = embedding
-                all_embeddings.append(embedding)
-                self.template_list.append(template)
 
         # Create FAISS index if there are embeddings
         if all_embeddings:
@@ -106,8 +76,31 @@ class EmailProposalSystem:
         distances, indices = self.index.search(np.array([query_embed]), 1)
         return self.template_list[indices[0][0]]
 
-    def generate_email(self, company_name, decision_maker, decision_maker_position, query, situation, **kwargs):
-        """Generate personalized email using template and context"""
+    async def aretrieve_best_template(self, query):
+        """Async retrieve_best_template; concurrent query encodes are micro-batched"""
+        if not self.index:
+            raise ValueError("FAISS index has not been created. No templates available.")
+        query_embed = await self.encode_batcher.encode(query)
+        distances, indices = await run_in_threads(self.index.search, np.array([query_embed]), 1)
+        return self.template_list[indices[0][0]]
+
+    async def agenerate_email(self, company_name, decision_maker, decision_maker_position, query, situation, **kwargs):
+        """Async generate_email for use from FastAPI handlers"""
+        template = await self.aretrieve_best_template(query) if self.index else None
+        # The rest is dominated by the blocking LLM call, so it runs on the
+        # default executor rather than the CPU pool
+        return await asyncio.to_thread(
+            self.generate_email, company_name, decision_maker, decision_maker_position, query, situation,
+            template=template, **kwargs
+        )
+
+    def generate_email(self, company_name, decision_maker, decision_maker_position, query, situation, template=None, **kwargs):
+        """Generate personalized email using template and context
+
+        Near-duplicate requests are served from the semantic response cache;
+        pass use_cache=False to always call the LLM. llm_backend selects
+        "remote", "local" or "auto" routing for this request.
+        """
         # Check if FAISS index is available
         if not self.index:
             return {
@@ -116,7 +109,8 @@ class EmailProposalSystem:
             }
 
         # Retrieve template
-        template = self.retrieve_best_template(query)
+        if template is None:
+            template = self.retrieve_best_template(query)
 
         # Build context from kwargs
         req_info = json.loads(kwargs.get('req_info', '{}'))
@@ -145,6 +139,53 @@ class EmailProposalSystem:
         Urgency Factors: {', '.join(synergy_points.get('urgency_factors', []))}
         """
 
+        # Recipient-specific values are masked so near-duplicate requests that
+        # only differ by recipient map to the same cache entry
+        recipient_fields = {
+            "{{DECISION_MAKER}}": decision_maker,
+            "{{DECISION_MAKER_FIRST_NAME}}": decision_maker.split()[0] if decision_maker.split() else "",
+            "{{DECISION_MAKER_POSITION}}": decision_maker_position
+        }
+        use_cache = kwargs.get('use_cache', True) and can_mask(recipient_fields)
+        cache_partition = (template['title'], situation, company_name.lower().strip())
+        cache_text = mask_fields(
+            f"{kwargs.get('product_description', '')} {company_context} {decision_maker_context} {synergy_context} "
+            f"{kwargs.get('sender_name', '')} {kwargs.get('sender_position', '')} {kwargs.get('sender_company', '')}",
+            recipient_fields
+        )
+
+        # The email is personalized from the profile and synergies, so only reuse it
+        # verbatim when those match exactly; near matches go through the edit prompt
+        cache_fingerprint = hashlib.sha256(
+            mask_fields(f"{decision_maker_context}\0{synergy_context}", recipient_fields).encode("utf-8")
+        ).hexdigest()
+
+        if use_cache:
+            cache_embedding = self.response_cache.embed(cache_text)
+            cached, similarity, kind = self.response_cache.lookup(
+                cache_partition, cache_text, cache_embedding, fingerprint=cache_fingerprint
+            )
+            if kind == "hit":
+                print(f"Email cache hit (similarity {similarity:.3f})")
+                return self._with_content(cached, unmask_fields(self._content(cached), recipient_fields)), decision_maker_profile.get('personality_type', '')
+            if kind == "edit":
+                print(f"Email cache edit (similarity {similarity:.3f})")
+                edit_prompt = f"""
+        Adapt this previously generated email JSON for a new recipient. Keep the structure, subject style and HTML formatting. Replace anything drawn from the previous recipient's profile (achievements, recent activities, interests) with details from the new context, and change nothing else.
+        --- EMAIL BEGIN ---
+        {unmask_fields(self._content(cached), recipient_fields)}
+        --- EMAIL END ---
+
+        New Context:
+        - Decision Maker Name: {decision_maker}
+        - Decision Maker Position: {decision_maker_position}
+        - Decision Maker Profile: {decision_maker_context}
+        - Synergy Points: {synergy_context}
+
+        STRICTLY output only the JSON with 'subject' and 'body' keys.
+        """
+                return self._call_llm_api(edit_prompt, decision_maker_profile.get('personality_type', ''), kwargs.get('llm_backend'))
+
         # Construct AI prompt
         prompt = f"""
         Generate a highly personalized email using this template:
@@ -184,9 +225,29 @@ class EmailProposalSystem:
         
 
         # Call your API here (implementation depends on your API client)
-        return self._call_llm_api(prompt, decision_maker_profile.get('personality_type', ''))
+        result = self._call_llm_api(prompt, decision_maker_profile.get('personality_type', ''), kwargs.get('llm_backend'))
+        if use_cache and isinstance(result, tuple) and self._content(result[0]):
+            masked = self._with_content(result[0], mask_fields(self._content(result[0]), recipient_fields))
+            self.response_cache.store(cache_partition, cache_text, masked, cache_embedding, fingerprint=cache_fingerprint)
+        return result
+
+    @staticmethod
+    def _content(response):
+        """Message content of a chat completion response, if any"""
+        try:
+            return response["choices"][0]["message"]["content"]
+        except (TypeError, KeyError, IndexError):
+            return None
+
+    @staticmethod
+    def _with_content(response, content):
+        """Copy of a chat completion response with its content replaced"""
+        response = copy.deepcopy(response)
+        response["choices"][0]["message"]["content"] = content
+        response["usage"] = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        return response
 
-    def _call_llm_api(self, prompt, decision_maker_context=None):
+    def _call_llm_api(self, prompt, decision_maker_context=None, backend=None):
         """Mock API call implementation"""
         # Replace with actual API call
         # call the API with the prompt and get the response
@@ -195,7 +256,7 @@ class EmailProposalSystem:
             {"role": "user", "content": prompt}
         ]
 
-        response = chat_completion(messages, 900)
+        response = chat_completion(messages, 900, backend)
         # parse the response to extract the subject and body
         try:
             data = response
@@ -3,6 +3,7 @@ import re
 import logging
 import requests
 import concurrent.futures
+from resilience import get_upstream
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -11,36 +12,60 @@ logger = logging.getLogger(__name__)
 MAILTESTER_API_URL = "https://happy.mailtester.ninja/ninja"
 MAILTESTER_TOKEN_URL = "https://token.mailtester.ninja/token?key=yourkey"
 MAILTESTER_API_KEY = os.getenv("MAILTESTER_API_KEY")
+# Status reported when MailTester could not give an answer (as opposed to rejecting the address)
+VERIFICATION_ERROR = "error"
+
+# Precompiled once; the local-part class is RFC 5322 atext (ASCII only)
+EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9.!#$%&'*+/=?^_`{|}~-]+@[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*$")
+
+# Candidate formats in priority order; {f}/{l} are first/last name, {fi}/{li} initials
+EMAIL_CANDIDATE_FORMATS = [
+    "{f}.{l}@{d}",      # john.doe@
+    "{fi}{l}@{d}",      # jdoe@
+    "{f}{l}@{d}",       # johndoe@
+    "{f}@{d}",          # john@
+    "{f}{li}@{d}",      # johnd@
+    # Highest probability formats (85% coverage)
+    "{fi}.{l}@{d}",     # j.doe@
+    "{l}{fi}@{d}",      # doej@
+    "{f}.{li}@{d}",     # john.d@
+
+    # Common professional formats
+    "{f}_{l}@{d}",      # john_doe@
+    "{l}.{f}@{d}",      # doe.john@
+
+    # Less common but valid formats
+    "{f}-{l}@{d}",      # john-doe@
+]
+_CANDIDATE_FORMATTERS = [fmt.format_map for fmt in EMAIL_CANDIDATE_FORMATS]
 
 def is_valid_email_format(email: str) -> bool:
     """Validate email format with strict regex"""
-    email_regex = r'^[a-zA-Z0-9.!#$%&’*+/=?^_`{|}~-]+@[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)*$'
-    return re.fullmatch(email_regex, email) is not None
+    return EMAIL_REGEX.fullmatch(email) is not None
 
 def generate_email_combinations(first_name: str, last_name: str, domain: str) -> list:
     """Generate prioritized email combinations with likelihood ranking"""
     first = first_name.lower().strip()
     last = last_name.lower().strip()
     domain = domain.lower().strip()
-    
-    return [
-        f"{first}.{last}@{domain}",      # john.doe@
-        f"{first[0]}{last}@{domain}",    # jdoe@
-        f"{first}{last}@{domain}",       # johndoe@
-        f"{first}@{domain}",             # john@
-        f"{first}{last[0]}@{domain}",    # johnd@
-        # Highest probability formats (85% coverage)
-        f"{first[0]}.{last}@{domain}",   # j.doe@
-        f"{last}{first[0]}@{domain}",    # doej@
-        f"{first}.{last[0]}@{domain}",    # john.d@
-        
-        # Common professional formats
-        f"{first}_{last}@{domain}",      # john_doe@
-        f"{last}.{first}@{domain}",      # doe.john@
-        
-        # Less common but valid formats
-        f"{first}-{last}@{domain}",      # john-doe@
-    ]
+    parts = {"f": first, "l": last, "fi": first[:1], "li": last[:1], "d": domain}
+    return [format_candidate(parts) for format_candidate in _CANDIDATE_FORMATTERS]
+
+def generate_candidates_batch(leads: list) -> list:
+    """Generate format-valid candidates for many (first, last, domain) leads
+
+    Inputs are expected to be normalized already (see lead_import). Leads
+    with a malformed domain get an empty candidate list.
+    """
+    results = []
+    fullmatch = EMAIL_REGEX.fullmatch
+    for first, last, domain in leads:
+        if not (first and last and fullmatch(f"test@{domain}")):
+            results.append([])
+            continue
+        parts = {"f": first, "l": last, "fi": first[0], "li": last[0], "d": domain}
+        results.append([email for email in (fmt(parts) for fmt in _CANDIDATE_FORMATTERS) if fullmatch(email)])
+    return results
 
 def get_mailtester_token(api_key: str) -> str:
     """Retrieve the authentication token from MailTester API"""
@@ -58,7 +83,9 @@ def verify_email_api(email: str, token: str) -> bool:
         "email": email,
         "token": token
     }
-    response = requests.get(MAILTESTER_API_URL, params=params)
+    response = get_upstream("mailtester").call(
+        lambda timeout: requests.get(MAILTESTER_API_URL, params=params, timeout=timeout)
+    )
     if response.status_code == 200:
         data = response.json()
         logger.info(f"API response for {email}: {data}")
@@ -68,11 +95,12 @@ def verify_email_api(email: str, token: str) -> bool:
             logger.error(f"Failed to verify {email} via API")
             return False, data.get("message")
     else:
-        logger.error(f"Failed to verify {email} via API")
-        return False, data.get("message")
+        logger.error(f"Failed to verify {email} via API (HTTP {response.status_code})")
+        return False, VERIFICATION_ERROR
 
 def verify_email_candidate(email: str, token: str) -> str | None:
     """Verify a single email candidate"""
+    status = None
     if is_valid_email_format(email):
         try:
             emailRef, status = verify_email_api(email, token)
@@ -81,6 +109,7 @@ def verify_email_candidate(email: str, token: str) -> str | None:
                 return email, status
         except Exception as e:
             logger.error(f"Verification failed for {email}: {str(e)}")
+            status = VERIFICATION_ERROR
     return None, status
 
 def find_valid_email(first_name: str, last_name: str, domain: str) -> str | None:
@@ -101,6 +130,15 @@ def find_valid_email(first_name: str, last_name: str, domain: str) -> str | None
     if not token:
         return None, None
 
+    return verify_candidates(candidates, token)
+
+def verify_candidates(candidates: list, token: str):
+    """Return the first candidate that verifies, as (email, status)
+
+    If nothing verified and any check errored, the status is VERIFICATION_ERROR
+    so callers can tell "no deliverable address" from "couldn't check".
+    """
+    errored = False
     with concurrent.futures.ThreadPoolExecutor() as executor:
         future_to_email = {executor.submit(verify_email_candidate, email, token): email for email in candidates}
         for future in concurrent.futures.as_completed(future_to_email):
@@ -109,9 +147,13 @@ def find_valid_email(first_name: str, last_name: str, domain: str) -> str | None
                 result, status = future.result()
                 if result:
                     return result, status
+                errored = errored or status == VERIFICATION_ERROR
             except Exception as e:
                 logger.error(f"Verification failed for {email}: {str(e)}")
+                errored = True
 
+    if errored:
+        return None, VERIFICATION_ERROR
     logger.info("No deliverable email found")
     return None, None
 
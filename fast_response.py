@@ -0,0 +1,69 @@
+import gzip
+import json
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:  # zstd is only offered when zstandard is installed
+    zstandard = None
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+_zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard else None
+
+
+def dumps(content) -> bytes:
+    """Encode trusted, already JSON-shaped data (dicts/lists/str/numbers)"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def negotiate_encoding(accept_encoding: str):
+    """Pick zstd or gzip from an Accept-Encoding header, or None"""
+    offered = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            offered[name] = quality
+    for encoding in (("zstd",) if _zstd_compressor else ()) + ("gzip",):
+        if offered.get(encoding, offered.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding):
+    if encoding == "zstd":
+        return _zstd_compressor.compress(body)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def fast_json_response(request, content, status_code=200):
+    """JSON response for bulk endpoints, skipping response_model validation
+
+    Only use with data the service built itself: it is encoded as-is, then
+    compressed when the client accepts zstd/gzip and the body is large enough.
+    """
+    body = dumps(content)
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(request.headers.get("accept-encoding")) if len(body) >= MIN_COMPRESS_BYTES else None
+    if encoding:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, status_code=status_code, headers=headers, media_type="application/json")
@@ -1,9 +1,12 @@
 import requests
 import os
 from dotenv import load_dotenv
+from resilience import get_upstream, UpstreamError
 
 load_dotenv()
 
+RAPIDAPI_SEARCH_URL = os.getenv("RAPIDAPI_SEARCH_URL", "https://duckduckgo8.p.rapidapi.com/")
+
 # def google_search(api_key, search_engine_id, query, limit):
 #     url = "https://www.googleapis.com/customsearch/v1"
 #     params = {
@@ -16,7 +19,7 @@ load_dotenv()
 #     return response.json()
 
 def google_search(query, limit):
-    url = "https://duckduckgo8.p.rapidapi.com/"
+    url = RAPIDAPI_SEARCH_URL
     querystring = {"q": query }
 
     headers = {
@@ -24,8 +27,15 @@ def google_search(query, limit):
         "x-rapidapi-key": os.getenv("RAPIDAPI_KEY")
     }
 
+    def attempt(timeout):
+        response = requests.get(url, headers=headers, params=querystring, timeout=timeout)
+        # Only rate limiting and server errors count against the circuit breaker
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+
     try:
-        response = requests.get(url, headers=headers, params=querystring)
+        response = get_upstream("rapidapi_search").call(attempt)
         
         # Handle specific HTTP status codes
         if response.status_code == 403:
@@ -54,7 +64,13 @@ def google_search(query, limit):
             print(f"Unexpected API response structure: {data}")
             return []
             
-    except requests.exceptions.RequestException as e:
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code == 429:
+            print("Rate limit exceeded: Too many requests to the API")
+        else:
+            print(f"HTTP Error: {e}")
+        return []
+    except (requests.exceptions.RequestException, UpstreamError) as e:
         print(f"Request error: {e}")
         return []
     except KeyError as e:
@@ -1,13 +1,57 @@
 import requests
 import os
 import json
+import re
+import time
+import threading
+import concurrent.futures
+from resilience import get_upstream, UpstreamError
 
 # Set your API key
 API_KEY = os.getenv("PERPLEXITY_API_KEY")
+PERPLEXITY_API_URL = os.getenv("PERPLEXITY_API_URL", "https://api.perplexity.ai/chat/completions")
+
+# Default LLM routing: "remote" (Perplexity), "local" (deepseek.LocalGenerator),
+# or "auto" (Perplexity, falling back to the local model when it fails or its
+# circuit is open). Callers can override per request with `backend=`.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "remote")
+
+# Company research is reused for every contact at the same account within a
+# time bucket (default: one week), so news/financials stay reasonably fresh.
+COMPANY_ANALYSIS_BUCKET_SECONDS = int(os.getenv("COMPANY_ANALYSIS_BUCKET_SECONDS", 7 * 24 * 3600))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 2048))
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 8))
+
+ANALYST_SYSTEM_PROMPT = "You are a senior business analyst with expertise in enterprise decision-making dynamics."
+
+# Stage results are stored as futures so concurrent requests for the same key
+# share a single in-flight LLM call instead of each paying for it.
+_analysis_cache = {}
+_analysis_lock = threading.Lock()
+_analysis_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS)
 
 # Function to call the chat completions endpoint
-def chat_completion(messages, tokens):
-    url = "https://api.perplexity.ai/chat/completions"  # Replace with the correct Perplexity chat completions endpoint
+def chat_completion(messages, tokens, backend=None):
+    backend = backend or LLM_BACKEND
+    if backend == "local":
+        return _local_chat_completion(messages, tokens)
+    response = _remote_chat_completion(messages, tokens)
+    if response is None and backend == "auto":
+        print("Remote completion failed, falling back to local model")
+        return _local_chat_completion(messages, tokens)
+    return response
+
+def _local_chat_completion(messages, tokens):
+    try:
+        # Imported lazily: torch/transformers are only needed for local inference
+        from deepseek import get_local_generator
+        return get_local_generator().chat_completion(messages, tokens)
+    except Exception as e:
+        print(f"Local completion error: {e}")
+        return None
+
+def _remote_chat_completion(messages, tokens):
+    url = PERPLEXITY_API_URL
 
     payload = {
             "model": "sonar",
@@ -22,54 +66,160 @@ def chat_completion(messages, tokens):
         "Content-Type": "application/json",
     }
 
-    try:
-        response = requests.post(url, json=payload, headers=headers)
+    def attempt(timeout):
+        response = requests.post(url, json=payload, headers=headers, timeout=timeout)
         response.raise_for_status()
         return response.json()
-    except requests.exceptions.RequestException as e:
+
+    try:
+        # Deadline, hedging and circuit breaking are configured per upstream
+        return get_upstream("perplexity").call(attempt)
+    except (requests.exceptions.RequestException, UpstreamError) as e:
         print(f"Error: {e}")
         return None
 
-# Function to create chat messages and retrieve information
-def get_company_and_person_info(company_name, person_name, position, product_description):
-    """Enhanced information gathering for hyper-personalized emails"""
-    prompt = (
-    f"Product: {product_description}\n"
-    f"Company: {company_name}\n"
-    f"Decision Maker: {person_name}, {position}\n\n"
-    "Analyze the following:\n"
-    "1. Company Analysis: Provide recent news (past 6 months), financial trends/earnings, key challenges (operational efficiency, market competition, tech adoption), industry ranking, and strategic initiatives.\n"
-    "2. Decision Maker Profile: Describe communication style (data-driven, visionary, pragmatic), personality indicators, Myers-Briggs type (4-5 words with full form), key achievements, and recent activities.\n"
-    "3. Synergy Analysis: Map product capabilities to the company’s needs, align value proposition with the decision maker's style, and list 3 key persuasion leverage points.\n\n"
-    "Output strictly as JSON with these keys:\n"
-    '{"company_analysis": {"recent_news": "str", "financial_health": "str", "verified_challenges": ["str"], "strategic_priorities": ["str"]}, "decision_maker_profile": {"communication_style": "str", "personality_indicators": "str", "personality_type": "str", "key_achievements": "str", "recent_activities": "str"}, "synergy_points": {"product_fit": "str", "persuasion_levers": ["str"], "urgency_factors": ["str"]}}'
-)
+def _normalize(value):
+    return " ".join(str(value or "").lower().split())
 
+def _print_usage(stage, response):
+    usage = response.get("usage", {})
+    print(f"[{stage}] Input tokens: {usage.get('prompt_tokens', 0) * 0.0000002}")
+    print(f"[{stage}] Output tokens: {usage.get('completion_tokens', 0) * 0.0000002}")
+    print(f"[{stage}] Total tokens: {usage.get('total_tokens', 'N/A')}")
+
+def _parse_json_content(response):
+    """Extract the JSON object from a chat completion response"""
+    content = response["choices"][0]["message"]["content"]
+    match = re.search(r'\{.*\}', content, re.DOTALL)
+    return json.loads(match.group(0) if match else content)
+
+def _run_stage(stage, prompt, tokens, backend=None):
+    """Run one analysis prompt and return its parsed JSON output"""
     messages = [
-        {
-            "role": "system",
-            "content": "You are a senior business analyst with expertise in enterprise decision-making dynamics."
-        },
-        {
-            "role": "user",
-            "content": prompt
-        }
+        {"role": "system", "content": ANALYST_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
     ]
+    response = chat_completion(messages, tokens, backend)
+    if response is None:
+        raise RuntimeError(f"{stage} request failed")
+    _print_usage(stage, response)
+    return _parse_json_content(response)
+
+def _cached_stage(key, fn, *args):
+    """Submit a stage once per key and return its future"""
+    with _analysis_lock:
+        future = _analysis_cache.get(key)
+        if future is None:
+            future = _analysis_executor.submit(fn, *args)
+            _analysis_cache[key] = future
+            while len(_analysis_cache) > ANALYSIS_CACHE_MAX_ENTRIES:
+                _analysis_cache.pop(next(iter(_analysis_cache)))
+    return future
 
+def _stage_result(key, future):
+    """Wait for a stage; failed results are evicted so the next call retries"""
+    try:
+        return future.result()
+    except Exception:
+        with _analysis_lock:
+            if _analysis_cache.get(key) is future:
+                del _analysis_cache[key]
+        raise
+
+def _company_analysis_stage(company_name, backend=None):
+    prompt = (
+        f"Company: {company_name}\n\n"
+        "Provide recent news (past 6 months), financial trends/earnings, key challenges (operational efficiency, market competition, tech adoption), industry ranking, and strategic initiatives.\n\n"
+        "Output strictly as JSON with these keys:\n"
+        '{"recent_news": "str", "financial_health": "str", "verified_challenges": ["str"], "strategic_priorities": ["str"]}'
+    )
+    return _run_stage("company_analysis", prompt, 500, backend)
+
+def _person_profile_stage(company_name, person_name, position, backend=None):
+    prompt = (
+        f"Company: {company_name}\n"
+        f"Decision Maker: {person_name}, {position}\n\n"
+        "Describe communication style (data-driven, visionary, pragmatic), personality indicators, Myers-Briggs type (4-5 words with full form), key achievements, and recent activities.\n\n"
+        "Output strictly as JSON with these keys:\n"
+        '{"communication_style": "str", "personality_indicators": "str", "personality_type": "str", "key_achievements": "str", "recent_activities": "str"}'
+    )
+    return _run_stage("decision_maker_profile", prompt, 300, backend)
+
+def _synergy_stage(company_name, person_name, position, product_description, company_analysis, decision_maker_profile, backend=None):
+    prompt = (
+        f"Product: {product_description}\n"
+        f"Company: {company_name}\n"
+        f"Decision Maker: {person_name}, {position}\n"
+        f"Company Analysis: {json.dumps(company_analysis)}\n"
+        f"Decision Maker Profile: {json.dumps(decision_maker_profile)}\n\n"
+        "Map product capabilities to the company’s needs, align value proposition with the decision maker's style, and list 3 key persuasion leverage points.\n\n"
+        "Output strictly as JSON with these keys:\n"
+        '{"product_fit": "str", "persuasion_levers": ["str"], "urgency_factors": ["str"]}'
+    )
+    return _run_stage("synergy_points", prompt, 300, backend)
+
+def _company_key(company_name):
+    bucket = int(time.time() // COMPANY_ANALYSIS_BUCKET_SECONDS)
+    return ("company", _normalize(company_name), bucket)
+
+def _person_key(company_name, person_name):
+    return ("person", _normalize(person_name), _normalize(company_name))
+
+def get_company_analysis(company_name, backend=None):
+    """Company-level research, shared by every contact at the account"""
+    key = _company_key(company_name)
+    return _stage_result(key, _cached_stage(key, _company_analysis_stage, company_name, backend))
+
+def get_person_profile(company_name, person_name, position, backend=None):
+    """Decision-maker profile, cached per person and company"""
+    key = _person_key(company_name, person_name)
+    return _stage_result(key, _cached_stage(key, _person_profile_stage, company_name, person_name, position, backend))
+
+# Function to create chat messages and retrieve information
+def get_company_and_person_info(company_name, person_name, position, product_description, backend=None):
+    """Enhanced information gathering for hyper-personalized emails
+
+    Company research, the decision-maker profile and the synergy mapping run
+    as separately cached stages; the company and person stages run
+    concurrently and the synergy stage combines their results.
+    """
+    company_key = _company_key(company_name)
+    person_key = _person_key(company_name, person_name)
+    synergy_key = ("synergy",) + company_key[1:] + person_key[1:2] + (_normalize(product_description),)
 
     try:
-        response = chat_completion(messages, 900)
+        company_future = _cached_stage(company_key, _company_analysis_stage, company_name, backend)
+        person_future = _cached_stage(person_key, _person_profile_stage, company_name, person_name, position, backend)
+        company_analysis = _stage_result(company_key, company_future)
+        decision_maker_profile = _stage_result(person_key, person_future)
 
-        data = response
-        usage = data.get("usage", {})
-        print(f"Input tokens: {usage.get('prompt_tokens', 'N/A') * 0.0000002}")
-        print(f"Output tokens: {usage.get('completion_tokens', 'N/A') * 0.0000002}")
-        print(f"Total tokens: {usage.get('total_tokens', 'N/A')}")
+        synergy_future = _cached_stage(
+            synergy_key, _synergy_stage, company_name, person_name, position,
+            product_description, company_analysis, decision_maker_profile, backend
+        )
+        synergy_points = _stage_result(synergy_key, synergy_future)
 
-        return response
-    except (json.JSONDecodeError, KeyError) as e:
+        return {
+            "company_analysis": company_analysis,
+            "decision_maker_profile": decision_maker_profile,
+            "synergy_points": synergy_points
+        }
+    except (json.JSONDecodeError, KeyError, IndexError, RuntimeError) as e:
         return {"error": f"Analysis failed: {str(e)}"}
 
+def get_account_info(company_name, contacts, product_description, backend=None):
+    """Analyze several contacts at one account, sharing the company research
+
+    `contacts` is a list of (person_name, position) pairs. Results are
+    returned in the same order.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(contacts))) as executor:
+        futures = [
+            executor.submit(get_company_and_person_info, company_name, person_name, position, product_description, backend)
+            for person_name, position in contacts
+        ]
+        return [future.result() for future in futures]
+
 # # Example usage
 # if __name__ == "__main__":
 #     company = "Microsoft"
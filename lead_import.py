@@ -0,0 +1,239 @@
+import io
+import os
+import re
+import csv
+import hashlib
+import sqlite3
+import zipfile
+import threading
+import unicodedata
+import concurrent.futures
+from email_verifier import (
+    generate_candidates_batch, get_mailtester_token, verify_candidates, MAILTESTER_API_KEY, VERIFICATION_ERROR
+)
+
+LEAD_INDEX_PATH = os.getenv("LEAD_INDEX_PATH", "lead_index.sqlite3")
+LEAD_IMPORT_CHUNK_SIZE = int(os.getenv("LEAD_IMPORT_CHUNK_SIZE", 1000))
+LEAD_VERIFY_WORKERS = int(os.getenv("LEAD_VERIFY_WORKERS", 4))
+
+# Accepted header spellings, after lowercasing and collapsing separators to "_"
+COLUMN_ALIASES = {
+    "first_name": ("first_name", "firstname", "first", "given_name"),
+    "last_name": ("last_name", "lastname", "last", "surname", "family_name"),
+    "full_name": ("name", "full_name", "fullname"),
+    "domain": ("domain", "company_domain", "website", "company_website", "url", "email_domain"),
+}
+
+
+class LeadFileError(ValueError):
+    """The uploaded lead file is malformed or unreadable"""
+
+
+_HEADER_SEPARATORS = re.compile(r"[\s\-.]+")
+_NON_NAME_CHARS = re.compile(r"[^a-z]")
+_DOMAIN_PREFIX = re.compile(r"^(?:[a-z][a-z0-9+.-]*://)?(?:www\.)?")
+_DOMAIN_SUFFIX = re.compile(r"[/:?#].*$")
+
+
+def normalize_name(value):
+    """ASCII-fold and lowercase a name part, keeping letters only"""
+    folded = unicodedata.normalize("NFKD", str(value or "")).encode("ascii", "ignore").decode("ascii")
+    return _NON_NAME_CHARS.sub("", folded.lower())
+
+
+def normalize_domain(value):
+    """Reduce a website, URL or email address to a bare lowercase domain"""
+    domain = str(value or "").strip().lower()
+    if "@" in domain:
+        domain = domain.rsplit("@", 1)[1]
+    domain = _DOMAIN_PREFIX.sub("", domain)
+    return _DOMAIN_SUFFIX.sub("", domain).rstrip(".")
+
+
+def _map_columns(headers):
+    normalized = [_HEADER_SEPARATORS.sub("_", str(h or "").strip().lower()) for h in headers]
+    mapping = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in normalized:
+                mapping[field] = normalized.index(alias)
+                break
+    if "domain" not in mapping or not ({"first_name", "last_name"} <= mapping.keys() or "full_name" in mapping):
+        raise LeadFileError("Lead file needs a domain column and first/last name (or full name) columns")
+    return mapping
+
+
+def _normalize_row(row, mapping):
+    def cell(field):
+        index = mapping.get(field)
+        return row[index] if index is not None and index < len(row) else ""
+
+    first, last = cell("first_name"), cell("last_name")
+    if not (first and last) and "full_name" in mapping:
+        parts = str(cell("full_name") or "").split()
+        if len(parts) >= 2:
+            first, last = parts[0], parts[-1]
+    return normalize_name(first), normalize_name(last), normalize_domain(cell("domain"))
+
+
+def _iter_csv_rows(binary_file):
+    try:
+        yield from csv.reader(io.TextIOWrapper(binary_file, encoding="utf-8-sig", errors="replace", newline=""))
+    except csv.Error as e:
+        raise LeadFileError(f"Unreadable CSV file: {e}")
+
+
+def _iter_xlsx_rows(binary_file):
+    try:
+        from openpyxl import load_workbook
+        from openpyxl.utils.exceptions import InvalidFileException
+    except ImportError:
+        raise ValueError("XLSX import requires openpyxl")
+    # A corrupt or mislabelled upload fails inside the zip/XML layer, not with ValueError
+    try:
+        workbook = load_workbook(binary_file, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError) as e:
+        raise LeadFileError(f"Unreadable XLSX file: {e}")
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def iter_lead_chunks(binary_file, filename, chunk_size=LEAD_IMPORT_CHUNK_SIZE):
+    """Yield lists of normalized (first, last, domain) tuples, chunk by chunk"""
+    rows = _iter_xlsx_rows(binary_file) if filename.lower().endswith((".xlsx", ".xlsm")) else _iter_csv_rows(binary_file)
+    header = next(rows, None)
+    if header is None:
+        return
+    mapping = _map_columns(header)
+    chunk = []
+    for row in rows:
+        chunk.append(_normalize_row(row, mapping))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class LeadIndex:
+    """Persistent record of processed lead hashes, backed by SQLite
+
+    Each hash remembers whether the lead went out verified, so a verify
+    import still processes leads an earlier plain import already returned.
+    """
+
+    # Stay under SQLite's default bound-parameter limit
+    _QUERY_BATCH = 500
+
+    def __init__(self, path=LEAD_INDEX_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS leads (hash BLOB PRIMARY KEY, verified INTEGER NOT NULL DEFAULT 0)")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(leads)")}
+        if "verified" not in columns:
+            self._conn.execute("ALTER TABLE leads ADD COLUMN verified INTEGER NOT NULL DEFAULT 0")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def lead_hash(lead):
+        return hashlib.blake2b("|".join(lead).encode("utf-8"), digest_size=16).digest()
+
+    def filter_new(self, leads, verified=False):
+        """Return the leads not yet processed (in the index or earlier in `leads`)
+
+        With `verified`, leads recorded only by a non-verifying import count
+        as new. Nothing is recorded here; call `record` once a lead is out.
+        """
+        hashes = {}
+        for lead in leads:
+            hashes.setdefault(self.lead_hash(lead), lead)
+        keys = list(hashes)
+        with self._lock:
+            seen = set()
+            for start in range(0, len(keys), self._QUERY_BATCH):
+                batch = keys[start:start + self._QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                seen.update(row[0] for row in self._conn.execute(
+                    f"SELECT hash FROM leads WHERE hash IN ({placeholders}) AND verified >= ?", batch + [int(verified)]
+                ))
+        return [hashes[key] for key in keys if key not in seen]
+
+    def record(self, leads, verified=False):
+        """Mark leads as processed; a verified record is never downgraded"""
+        if not leads:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO leads (hash, verified) VALUES (?, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET verified = MAX(verified, excluded.verified)",
+                ((self.lead_hash(lead), int(verified)) for lead in leads)
+            )
+            self._conn.commit()
+
+
+_lead_index = None
+_lead_index_lock = threading.Lock()
+
+
+def get_lead_index():
+    global _lead_index
+    with _lead_index_lock:
+        if _lead_index is None:
+            _lead_index = LeadIndex()
+        return _lead_index
+
+
+def import_leads(binary_file, filename, verify=False, stats=None, chunk_size=LEAD_IMPORT_CHUNK_SIZE):
+    """Stream a lead file, yielding one result dict per new, well-formed lead
+
+    Rows are normalized, deduplicated against the persistent lead index and
+    expanded into format-valid email candidates a chunk at a time, so memory
+    stays bounded by `chunk_size`. With `verify`, each lead's candidates are
+    checked against MailTester before it is yielded. A lead is added to the
+    index only once the consumer has taken it, and not at all if its
+    verification errored, so it comes back on the next import. `stats` (a
+    dict) is updated with running counts.
+    """
+    stats = stats if stats is not None else {}
+    for key in ("rows", "duplicates", "invalid", "leads", "verified", "errors"):
+        stats.setdefault(key, 0)
+
+    token = None
+    if verify:
+        token = get_mailtester_token(MAILTESTER_API_KEY) if MAILTESTER_API_KEY else None
+        if not token:
+            raise ValueError("Email verification is unavailable (MailTester token could not be retrieved)")
+
+    index = get_lead_index()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=LEAD_VERIFY_WORKERS) as executor:
+        for chunk in iter_lead_chunks(binary_file, filename, chunk_size):
+            stats["rows"] += len(chunk)
+            candidates = generate_candidates_batch(chunk)
+            valid = [lead for lead, emails in zip(chunk, candidates) if emails]
+            stats["invalid"] += len(chunk) - len(valid)
+            new_leads = index.filter_new(valid, verified=verify)
+            stats["duplicates"] += len(valid) - len(new_leads)
+
+            by_lead = dict(zip(chunk, candidates))
+            results = executor.map(lambda lead: verify_candidates(by_lead[lead], token), new_leads) if verify else None
+            emitted = []
+            try:
+                for lead in new_leads:
+                    first, last, domain = lead
+                    result = {"first_name": first, "last_name": last, "domain": domain, "candidates": by_lead[lead]}
+                    errored = False
+                    if verify:
+                        email, status = next(results)
+                        result.update({"email": email, "status": status})
+                        stats["verified"] += email is not None
+                        errored = status == VERIFICATION_ERROR
+                        stats["errors"] += errored
+                    stats["leads"] += 1
+                    yield result
+                    # Resumed, so the consumer has taken the lead
+                    if not errored:
+                        emitted.append(lead)
+            finally:
+                index.record(emitted, verified=verify)
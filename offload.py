@@ -0,0 +1,86 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+import concurrent.futures
+
+# CPU-bound work (embedding forward passes, FAISS search, PDF parsing) runs
+# here instead of on the event loop thread. Torch and FAISS release the GIL,
+# so threads are enough for them; pure-Python PyPDF2 parsing uses processes.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", os.cpu_count() or 1))
+
+_thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+_process_pool = None
+
+
+def _get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # Forking while torch's thread pools are running can deadlock the child
+        _process_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+async def run_in_threads(fn, *args, **kwargs):
+    """Run a GIL-releasing CPU-bound call on the CPU thread pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_thread_pool, functools.partial(fn, *args, **kwargs))
+
+
+async def run_in_processes(fn, *args):
+    """Run a pure-Python CPU-bound call in the process pool (fn must be picklable)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_process_pool(), fn, *args)
+
+
+class EncodeBatcher:
+    """Coalesces concurrent single-text encodes into one batched encode call
+
+    The first request in a batch waits up to `max_wait_ms` for others to
+    arrive (or until `max_batch_size` is reached); the whole batch is then
+    encoded in a single forward pass on the CPU pool.
+    """
+
+    def __init__(self, model, max_wait_ms=None, max_batch_size=None, **encode_kwargs):
+        self.model = model
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("ENCODE_BATCH_WAIT_MS", 5))) / 1000
+        self.max_batch_size = max_batch_size or int(os.getenv("ENCODE_BATCH_SIZE", 64))
+        self.encode_kwargs = encode_kwargs
+        self._pending = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def encode(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._encode_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _encode_batch(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            embeddings = await run_in_threads(self.model.encode, texts, **self.encode_kwargs)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
@@ -0,0 +1,72 @@
+"""Template extraction from PDF playbooks
+
+Kept apart from email_proposal so PDF worker processes only import PyPDF2.
+"""
+import PyPDF2
+import re
+
+_WHITESPACE = re.compile(r'\s+')
+# Improved regex pattern to match numbered templates
+# Matches patterns like "1. Template Title" or "1.  Template Title" or "2. “I Feel Like a Stalker”"
+_TEMPLATE_SPLIT = re.compile(r'(\b\d+\.\s+“?[A-Za-z].+?”?)(?=\b\d+\.\s+“?[A-Za-z]|\Z)')
+_TEMPLATE_TITLE = re.compile(r'\b\d+\.\s+“?[A-Za-z].+?”?')
+
+
+def extract_templates_from_pdf(pdf_path):
+    """Extract numbered templates from a single PDF with error handling
+
+    Runs in offload.run_in_processes workers, which import this module to
+    unpickle it, so keep it free of heavy imports.
+    """
+    try:
+        print(f"Processing PDF: {pdf_path}")  # Debug statement
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            full_text = '\n'.join([page.extract_text() for page in reader.pages])
+            print(f"Extracted text from PDF:\n{full_text}")  # Debug statement
+
+        # Preprocess the text: Replace multiple spaces and newlines with a single space
+        full_text = _WHITESPACE.sub(' ', full_text).strip()
+
+        sections = _TEMPLATE_SPLIT.split(full_text)
+
+        templates = []
+        current_title = None
+        current_content = ""
+
+        for i, section in enumerate(sections):
+            if _TEMPLATE_TITLE.match(section.strip()):
+                # Found new template title
+                if current_title:
+                    # Add previous template if exists
+                    templates.append({
+                        'title': current_title.strip(),
+                        'content': current_content.strip(),
+                        'embedding': None
+                    })
+                current_title = section.strip()
+                current_content = ""
+            elif current_title:
+                # Accumulate content under current title
+                current_content += section.strip() + " "
+
+        # Add the last template
+        if current_title and current_content:
+            templates.append({
+                'title': current_title.strip(),
+                'content': current_content.strip(),
+                'embedding': None
+            })
+
+        if not templates:
+            print(f"No templates found in {pdf_path}")  # Debug statement
+
+        print(f"Found {len(templates)} templates in {pdf_path}:")  # Debug statement
+        for i, template in enumerate(templates, 1):
+            print(f"Template {i}: {template['title']}")  # Debug statement
+
+        return templates
+
+    except Exception as e:
+        print(f"Error processing {pdf_path}: {str(e)}")
+        return []
@@ -0,0 +1,332 @@
+import os
+import time
+import random
+import logging
+import threading
+import collections
+import concurrent.futures
+
+logger = logging.getLogger(__name__)
+
+# Per-upstream defaults; every value can be overridden with an environment
+# variable named <UPSTREAM>_<SETTING>, e.g. PERPLEXITY_TIMEOUT_SECONDS=30.
+UPSTREAM_DEFAULTS = {
+    "timeout_seconds": 30.0,
+    # Attempts in flight (including abandoned ones) per upstream; calls wait
+    # up to queue_timeout_seconds locally for a slot before any deadline starts
+    "max_concurrency": 16,
+    "queue_timeout_seconds": 10.0,
+    "hedge": True,
+    "hedge_initial_delay": 5.0,
+    "hedge_min_delay": 0.2,
+    "hedge_min_samples": 20,
+    "latency_window": 200,
+    "failure_rate_threshold": 0.5,
+    "min_requests": 10,
+    "failure_window": 50,
+    "open_seconds": 30.0,
+}
+
+UPSTREAM_CONFIG = {
+    "perplexity": {"timeout_seconds": 45.0, "hedge_initial_delay": 15.0},
+    "rapidapi_search": {"timeout_seconds": 10.0, "hedge_initial_delay": 2.0},
+    "mailtester": {"timeout_seconds": 10.0, "hedge": False, "max_concurrency": 48},
+}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class UpstreamTimeoutError(UpstreamError):
+    pass
+
+
+class UpstreamBusyError(UpstreamError):
+    """No local concurrency slot freed up in time; says nothing about upstream health"""
+    pass
+
+
+def _counts_as_failure(exc):
+    """Client errors (4xx other than 429) say nothing about upstream health"""
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status is None or status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker over a sliding window of outcomes"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_rate_threshold, min_requests, window, open_seconds):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self._outcomes = collections.deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at < self.open_seconds:
+                return False
+            # Half-open: let a single probe through
+            if self._probe_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            # Late results from calls started before the breaker opened
+            if self._state == self.OPEN:
+                return
+            if self._state == self.HALF_OPEN:
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            self._outcomes.append(True)
+
+    def record_failure(self):
+        with self._lock:
+            if self._state == self.OPEN:
+                return
+            if self._state == self.HALF_OPEN:
+                self._trip()
+                return
+            self._outcomes.append(False)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_requests and failures / len(self._outcomes) >= self.failure_rate_threshold:
+                self._trip()
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        logger.warning(f"{self.name} circuit breaker opened")
+
+    def failure_rate(self):
+        with self._lock:
+            return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+
+class Upstream:
+    """Deadline, hedging and circuit breaking for one upstream dependency
+
+    `call(fn)` runs `fn(timeout)` where `timeout` is the time left before the
+    deadline. If the first attempt has not finished after the recent p95
+    latency, a duplicate attempt is fired and whichever succeeds first wins.
+    """
+
+    def __init__(self, name, **config):
+        self.name = name
+        self.config = {**UPSTREAM_DEFAULTS, **config}
+        # Each upstream gets its own pool, so a hung provider can only exhaust
+        # its own slots. The pool is as large as the slot count, so submitted
+        # attempts never sit in the executor queue.
+        self._slots = threading.BoundedSemaphore(self.config["max_concurrency"])
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.config["max_concurrency"], thread_name_prefix=f"upstream-{name}"
+        )
+        self.breaker = CircuitBreaker(
+            name,
+            self.config["failure_rate_threshold"],
+            self.config["min_requests"],
+            self.config["failure_window"],
+            self.config["open_seconds"]
+        )
+        self._latencies = collections.deque(maxlen=self.config["latency_window"])
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < self.config["hedge_min_samples"]:
+            return self.config["hedge_initial_delay"]
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return max(self.config["hedge_min_delay"], p95)
+
+    def _submit(self, fn, timeout):
+        """Start an attempt on a slot already acquired; the slot frees when it finishes"""
+        def run():
+            try:
+                return fn(timeout)
+            finally:
+                self._slots.release()
+        return self._executor.submit(run)
+
+    def call(self, fn, timeout=None):
+        # Waiting for a local slot is not upstream latency: it happens before
+        # the deadline starts and never counts against the breaker
+        if not self._slots.acquire(timeout=self.config["queue_timeout_seconds"]):
+            self._count("saturated")
+            raise UpstreamBusyError(f"{self.name} has no free concurrency slot")
+        if not self.breaker.allow():
+            self._slots.release()
+            self._count("short_circuited")
+            raise CircuitOpenError(f"{self.name} circuit is open")
+
+        timeout = timeout or self.config["timeout_seconds"]
+        start = time.monotonic()
+        deadline = start + timeout
+        hedge_at = start + self.hedge_delay() if self.config["hedge"] else None
+        pending = {self._submit(fn, timeout)}
+        primary = next(iter(pending))
+        last_error = None
+        self._count("requests")
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_at) if hedge_at else deadline
+            done, pending = concurrent.futures.wait(
+                pending, timeout=max(0.0, wait_until - now), return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                self._record_success(time.monotonic() - start, hedged=future is not primary)
+                return result
+            if hedge_at and time.monotonic() >= hedge_at and pending:
+                hedge_at = None
+                # Hedge only if a slot is free right now; never queue for one
+                if self._slots.acquire(blocking=False):
+                    self._count("hedges")
+                    pending.add(self._submit(fn, max(0.0, deadline - time.monotonic())))
+                else:
+                    self._count("hedges_skipped")
+
+        if last_error is not None and not pending:
+            if _counts_as_failure(last_error):
+                self._record_failure("failures")
+            else:
+                self.breaker.record_success()
+            raise last_error
+        self._record_failure("timeouts")
+        raise UpstreamTimeoutError(f"{self.name} did not respond within {timeout:.1f}s")
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            "state": self.breaker.state,
+            "failure_rate": round(self.breaker.failure_rate(), 3),
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+            **counters
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._counters[key] += 1
+
+    def _record_success(self, latency, hedged):
+        with self._lock:
+            self._latencies.append(latency)
+            if hedged:
+                self._counters["hedge_wins"] += 1
+        self.breaker.record_success()
+
+    def _record_failure(self, key):
+        self._count(key)
+        self.breaker.record_failure()
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def _env_override(name, key, default):
+    value = os.getenv(f"{name.upper()}_{key.upper()}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes")
+    return type(default)(value)
+
+
+def get_upstream(name):
+    """Shared Upstream for `name`, configured from UPSTREAM_CONFIG and env"""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            config = {**UPSTREAM_DEFAULTS, **UPSTREAM_CONFIG.get(name, {})}
+            config = {key: _env_override(name, key, value) for key, value in config.items()}
+            _upstreams[name] = Upstream(name, **config)
+        return _upstreams[name]
+
+
+def metrics():
+    """Breaker state and counters for every upstream used so far"""
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    return {upstream.name: upstream.metrics() for upstream in upstreams}
+
+
+# Example usage against a local fake server with injected latency:
+#   python resilience.py
+if __name__ == "__main__":
+    import json
+    import requests
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class SlowHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            # ~10% of responses are slow, ~5% fail
+            roll = random.random()
+            time.sleep(1.5 if roll < 0.1 else 0.05)
+            try:
+                self.send_response(500 if roll > 0.95 else 200)
+                self.end_headers()
+                self.wfile.write(b"{}")
+            except BrokenPipeError:
+                # Client gave up (deadline) or a hedge already won
+                pass
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    def fetch(timeout):
+        response = requests.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    upstream = Upstream("fake", timeout_seconds=1.0, hedge_initial_delay=0.2, min_requests=20)
+    latencies = []
+    for _ in range(200):
+        start = time.monotonic()
+        try:
+            upstream.call(fetch)
+        except Exception:
+            pass
+        latencies.append(time.monotonic() - start)
+    latencies.sort()
+    print(f"p50={latencies[100]:.3f}s p99={latencies[197]:.3f}s")
+    print(json.dumps(upstream.metrics(), indent=2))
+    server.shutdown()
@@ -1,24 +1,28 @@
 import os
 from base64 import b64decode
+from functools import lru_cache
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 
-def decrypt_password(encrypted_password: str) -> str:
+@lru_cache(maxsize=1)
+def _cipher_params() -> tuple:
+    """Decode ENCRYPTION_KEY / ENCRYPTION_IV once per process"""
     secret_key = os.environ.get("ENCRYPTION_KEY")
     iv = os.environ.get("ENCRYPTION_IV")
-    print("SECRET KEY", secret_key)
-    print("IV", iv)
     if not secret_key or not iv:
         raise ValueError("ENCRYPTION_KEY or ENCRYPTION_IV environment variable is not set")
-    
-    
+    return b64decode(secret_key), iv.encode('utf-8')
+
+def decrypt_password(encrypted_password: str) -> str:
+    derived_key, iv = _cipher_params()
     ciphertext = b64decode(encrypted_password)
-    derived_key = b64decode(secret_key)
-    cipher = AES.new(derived_key, AES.MODE_CBC, iv.encode('utf-8'))
+    # CBC cipher objects are stateful, so each decryption needs a fresh one
+    cipher = AES.new(derived_key, AES.MODE_CBC, iv)
     decrypted_data = cipher.decrypt(ciphertext)
     return unpad(decrypted_data, 16).decode("utf-8")
 
 # Example usage
-encrypted_password = "XMupu5u4sNSL3+UyfXPb4Q=="
-decrypted_password = decrypt_password(encrypted_password)
-print(decrypted_password)
\ No newline at end of file
+if __name__ == "__main__":
+    encrypted_password = "XMupu5u4sNSL3+UyfXPb4Q=="
+    decrypted_password = decrypt_password(encrypted_password)
+    print(decrypted_password)
@@ -0,0 +1,149 @@
+import re
+import time
+import threading
+import numpy as np
+
+# Values shorter than this, or that are also everyday words, can't be masked
+# reliably ("Al" inside "Also", "Will" as a verb); requests carrying them
+# should bypass the cache rather than risk serving a corrupted email.
+MIN_MASK_LENGTH = 3
+COMMON_WORD_NAMES = {
+    "will", "mark", "bill", "frank", "grace", "hope", "joy", "faith", "may", "june",
+    "april", "august", "rose", "dawn", "sunny", "art", "max", "chase", "hunter",
+    "summer", "autumn", "price", "young", "king", "long", "white", "black", "brown",
+    "green", "rich", "sterling", "guy", "miles", "pat", "sue", "ray", "gene", "don",
+}
+
+
+def can_mask(fields: dict) -> bool:
+    """True if every recipient value can be masked without touching other text"""
+    for value in fields.values():
+        if not value:
+            continue
+        if len(value) < MIN_MASK_LENGTH or any(word.lower() in COMMON_WORD_NAMES for word in value.split()):
+            return False
+    return True
+
+
+def _value_pattern(value):
+    # Lookarounds instead of \b so values ending in punctuation still match
+    return re.compile(rf"(?<!\w){re.escape(value)}(?!\w)")
+
+
+def mask_fields(text: str, fields: dict) -> str:
+    """Replace whole-word occurrences of recipient-specific values with placeholders"""
+    # Longest values first so "Sarah Johnson" is masked before "Sarah"
+    for placeholder, value in sorted(fields.items(), key=lambda item: len(item[1] or ""), reverse=True):
+        if value:
+            text = _value_pattern(value).sub(lambda _: placeholder, text)
+    return text
+
+
+def unmask_fields(text: str, fields: dict) -> str:
+    """Substitute placeholders back with the current recipient's values"""
+    for placeholder, value in fields.items():
+        text = text.replace(placeholder, value or "")
+    return text
+
+
+class SemanticCache:
+    """Similarity cache for LLM outputs keyed on prompt embeddings
+
+    Entries live in partitions (e.g. template + situation + company) and are
+    matched by cosine similarity of their key text. A lookup at or above
+    `threshold` can be reused as-is, provided its `fingerprint` (a digest of
+    inputs that must match exactly) is the same as the stored entry's; one at
+    or above `edit_threshold` is close enough to serve as the base for a short
+    edit prompt.
+    """
+
+    def __init__(self, model, threshold=0.95, edit_threshold=0.88, max_entries=1000, ttl_seconds=86400):
+        self.model = model
+        self.threshold = threshold
+        self.edit_threshold = edit_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}  # partition -> list of entries, oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "edits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._similarity_histogram = {}
+
+    def embed(self, text):
+        return np.asarray(self.model.encode(text, normalize_embeddings=True), dtype=np.float32)
+
+    def lookup(self, partition, text, embedding=None, fingerprint=None):
+        """Return (output, similarity, kind) where kind is "hit", "edit" or None"""
+        if embedding is None:
+            embedding = self.embed(text)
+        with self._lock:
+            entries = self._expire(partition)
+            best, best_similarity = None, 0.0
+            if entries:
+                similarities = np.stack([entry["embedding"] for entry in entries]) @ embedding
+                index = int(np.argmax(similarities))
+                best, best_similarity = entries[index], float(similarities[index])
+
+            bucket = round(int(best_similarity * 20) / 20, 2)
+            self._similarity_histogram[bucket] = self._similarity_histogram.get(bucket, 0) + 1
+
+            if best is not None and best_similarity >= self.threshold and best["fingerprint"] == fingerprint:
+                self._stats["hits"] += 1
+                return best["output"], best_similarity, "hit"
+            if best is not None and best_similarity >= self.edit_threshold:
+                self._stats["edits"] += 1
+                return best["output"], best_similarity, "edit"
+            self._stats["misses"] += 1
+            return None, best_similarity, None
+
+    def store(self, partition, text, output, embedding=None, fingerprint=None):
+        if embedding is None:
+            embedding = self.embed(text)
+        with self._lock:
+            self._entries.setdefault(partition, []).append({
+                "embedding": embedding,
+                "fingerprint": fingerprint,
+                "output": output,
+                "created": time.time()
+            })
+            self._size += 1
+            self._stats["stores"] += 1
+            while self._size > self.max_entries:
+                self._evict_oldest()
+
+    def stats(self):
+        """Counters and best-match similarity histogram for threshold tuning"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["edits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "size": self._size,
+                "hit_rate": self._stats["hits"] / lookups if lookups else 0.0,
+                "edit_rate": self._stats["edits"] / lookups if lookups else 0.0,
+                "threshold": self.threshold,
+                "edit_threshold": self.edit_threshold,
+                "similarity_histogram": dict(sorted(self._similarity_histogram.items()))
+            }
+
+    def _expire(self, partition):
+        entries = self._entries.get(partition, [])
+        cutoff = time.time() - self.ttl_seconds
+        expired = 0
+        while expired < len(entries) and entries[expired]["created"] < cutoff:
+            expired += 1
+        if expired:
+            del entries[:expired]
+            self._size -= expired
+            self._stats["evictions"] += expired
+        return entries
+
+    def _evict_oldest(self):
+        partition = min(
+            (key for key, entries in self._entries.items() if entries),
+            key=lambda key: self._entries[key][0]["created"]
+        )
+        self._entries[partition].pop(0)
+        if not self._entries[partition]:
+            del self._entries[partition]
+        self._size -= 1
+        self._stats["evictions"] += 1
@@ -0,0 +1,285 @@
+import os
+import json
+import time
+import math
+import logging
+import threading
+from fastapi import HTTPException
+from dom import identify_smtp_server, send_notification_email
+from scrape import decrypt_password
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DAILY_LIMIT = int(os.getenv("SENDER_DAILY_LIMIT", 400))
+DEFAULT_PER_MINUTE_LIMIT = int(os.getenv("SENDER_PER_MINUTE_LIMIT", 20))
+# Shared quota counters; without it each process only sees its own sends
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Quota windows are fixed and UTC-aligned so every instance agrees on them
+QUOTA_WINDOWS = {"day": 86400, "minute": 60}
+
+
+def _window_start(period, now):
+    length = QUOTA_WINDOWS[period]
+    return int(now // length * length)
+
+
+class Mailbox:
+    """One sending account with its decrypted password and send quotas"""
+
+    def __init__(self, email, password, daily_limit=DEFAULT_DAILY_LIMIT,
+                 per_minute_limit=DEFAULT_PER_MINUTE_LIMIT, smtp_server=None, smtp_port=None):
+        self.email = email
+        self.password = password
+        self.daily_limit = daily_limit
+        self.per_minute_limit = per_minute_limit
+        self._smtp = (smtp_server, smtp_port or 587) if smtp_server else None
+
+    @property
+    def smtp(self):
+        """(server, port), resolved from MX records and cached per domain"""
+        if self._smtp is None:
+            self._smtp = identify_smtp_server(self.email)
+        return self._smtp
+
+    def limits(self):
+        return {"day": self.daily_limit, "minute": self.per_minute_limit}
+
+    def seconds_until_available(self, usage, now):
+        if usage["day"] >= self.daily_limit:
+            return None
+        if usage["minute"] < self.per_minute_limit:
+            return 0
+        return _window_start("minute", now) + QUOTA_WINDOWS["minute"] - now
+
+    def stats(self, usage):
+        return {
+            "email": self.email,
+            "sent_today": usage["day"],
+            "daily_limit": self.daily_limit,
+            "sent_this_minute": usage["minute"],
+            "per_minute_limit": self.per_minute_limit
+        }
+
+
+class MemoryQuotaStore:
+    """Per-process send counters; only correct with a single worker"""
+
+    def __init__(self):
+        self._counts = {}  # (email, period, window_start) -> sends
+        self._lock = threading.Lock()
+
+    def reserve(self, mailbox, now):
+        """Count one send against every window, or return None if any is full"""
+        keys = [(mailbox.email, period, _window_start(period, now)) for period in QUOTA_WINDOWS]
+        limits = mailbox.limits()
+        with self._lock:
+            if any(self._counts.get(key, 0) >= limits[key[1]] for key in keys):
+                return None
+            self._prune(now)
+            for key in keys:
+                self._counts[key] = self._counts.get(key, 0) + 1
+        return keys
+
+    def refund(self, reservation):
+        with self._lock:
+            for key in reservation:
+                if self._counts.get(key):
+                    self._counts[key] -= 1
+
+    def usage(self, mailboxes, now):
+        """{email: {"day": sends, "minute": sends}} for the current windows"""
+        with self._lock:
+            return {
+                mailbox.email: {
+                    period: self._counts.get((mailbox.email, period, _window_start(period, now)), 0)
+                    for period in QUOTA_WINDOWS
+                }
+                for mailbox in mailboxes
+            }
+
+    def _prune(self, now):
+        cutoff = _window_start("day", now)
+        for key in [key for key in self._counts if key[2] < cutoff]:
+            del self._counts[key]
+
+
+class SqlQuotaStore:
+    """Send counters shared by every worker and replica through the database
+
+    Each reservation is one transaction of conditional upserts, so concurrent
+    instances can't push a mailbox past its limits.
+    """
+
+    _RESERVE = (
+        "INSERT INTO sender_quota (email, period, window_start, sent) VALUES (:email, :period, :window_start, 1) "
+        "ON CONFLICT (email, period, window_start) DO UPDATE SET sent = sender_quota.sent + 1 "
+        "WHERE sender_quota.sent < :limit RETURNING sent"
+    )
+    _REFUND = (
+        "UPDATE sender_quota SET sent = sent - 1 "
+        "WHERE email = :email AND period = :period AND window_start = :window_start AND sent > 0"
+    )
+    _USAGE = (
+        "SELECT email, period, sent FROM sender_quota "
+        "WHERE (period = 'day' AND window_start = :day) OR (period = 'minute' AND window_start = :minute)"
+    )
+    # Drop windows older than this, at most once per interval
+    _PRUNE_INTERVAL = 3600
+
+    def __init__(self, database_url):
+        from sqlalchemy import create_engine, text
+
+        self._text = text
+        self._engine = create_engine(database_url, pool_pre_ping=True)
+        with self._engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS sender_quota ("
+                "email VARCHAR(320) NOT NULL, period VARCHAR(16) NOT NULL, window_start BIGINT NOT NULL, "
+                "sent INTEGER NOT NULL, PRIMARY KEY (email, period, window_start))"
+            ))
+        self._last_prune = 0
+
+    def reserve(self, mailbox, now):
+        """Count one send against every window, or return None if any is full"""
+        limits = mailbox.limits()
+        reservation = [
+            {"email": mailbox.email, "period": period, "window_start": _window_start(period, now)}
+            for period in QUOTA_WINDOWS
+        ]
+        if any(limit <= 0 for limit in limits.values()):
+            return None
+        with self._engine.connect() as conn:
+            with conn.begin() as transaction:
+                for window in reservation:
+                    row = conn.execute(self._text(self._RESERVE), {**window, "limit": limits[window["period"]]}).first()
+                    if row is None:
+                        transaction.rollback()
+                        return None
+        self._prune(now)
+        return reservation
+
+    def refund(self, reservation):
+        with self._engine.begin() as conn:
+            conn.execute(self._text(self._REFUND), reservation)
+
+    def usage(self, mailboxes, now):
+        """{email: {"day": sends, "minute": sends}} for the current windows"""
+        usage = {mailbox.email: {period: 0 for period in QUOTA_WINDOWS} for mailbox in mailboxes}
+        params = {"day": _window_start("day", now), "minute": _window_start("minute", now)}
+        with self._engine.connect() as conn:
+            for email, period, sent in conn.execute(self._text(self._USAGE), params):
+                if email in usage:
+                    usage[email][period] = sent
+        return usage
+
+    def _prune(self, now):
+        if now - self._last_prune < self._PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        with self._engine.begin() as conn:
+            conn.execute(
+                self._text("DELETE FROM sender_quota WHERE window_start < :cutoff"),
+                {"cutoff": _window_start("day", now)}
+            )
+
+
+class SenderPool:
+    """Spreads outbound mail across many mailboxes within their quotas
+
+    Each send goes to the available mailbox with the most daily quota left,
+    so load stays even and no single account trips its provider's limits.
+    Passwords are decrypted once, when the pool is built. Quota counters live
+    in `store`; use a SqlQuotaStore when running more than one worker.
+    """
+
+    def __init__(self, mailboxes, store=None):
+        self.mailboxes = list(mailboxes)
+        self.store = store or MemoryQuotaStore()
+
+    @classmethod
+    def from_config(cls, entries, store=None):
+        """Build from dicts with email, encrypted_password and optional limits/smtp_server"""
+        return cls(
+            (
+                Mailbox(
+                    entry["email"],
+                    decrypt_password(entry["encrypted_password"]),
+                    daily_limit=entry.get("daily_limit", DEFAULT_DAILY_LIMIT),
+                    per_minute_limit=entry.get("per_minute_limit", DEFAULT_PER_MINUTE_LIMIT),
+                    smtp_server=entry.get("smtp_server"),
+                    smtp_port=entry.get("smtp_port")
+                )
+                for entry in entries
+            ),
+            store=store
+        )
+
+    @classmethod
+    def from_env(cls):
+        """Pool from SENDER_MAILBOXES (JSON) or SENDER_MAILBOXES_FILE; None if unset
+
+        Quotas are shared through DATABASE_URL when it is set.
+        """
+        raw = os.getenv("SENDER_MAILBOXES")
+        path = os.getenv("SENDER_MAILBOXES_FILE")
+        if not raw and path:
+            with open(path) as f:
+                raw = f.read()
+        if not raw:
+            return None
+        if DATABASE_URL:
+            store = SqlQuotaStore(DATABASE_URL)
+        else:
+            logger.warning("DATABASE_URL not set; sender quotas are tracked per process")
+            store = MemoryQuotaStore()
+        pool = cls.from_config(json.loads(raw), store=store)
+        logger.info(f"Sender pool loaded with {len(pool.mailboxes)} mailboxes")
+        return pool
+
+    def acquire(self):
+        """Reserve a send slot on the best available mailbox; returns (mailbox, reservation)"""
+        now = time.time()
+        usage = self.store.usage(self.mailboxes, now)
+        candidates = sorted(
+            (m for m in self.mailboxes if m.seconds_until_available(usage[m.email], now) == 0),
+            key=lambda m: m.daily_limit - usage[m.email]["day"],
+            reverse=True
+        )
+        # Another instance may take the last slot between reading usage and reserving
+        for mailbox in candidates:
+            reservation = self.store.reserve(mailbox, now)
+            if reservation is not None:
+                return mailbox, reservation
+
+        usage = self.store.usage(self.mailboxes, now)
+        waits = [w for w in (m.seconds_until_available(usage[m.email], now) for m in self.mailboxes) if w is not None]
+        if not waits:
+            raise HTTPException(status_code=429, detail="All sender mailboxes have reached their daily limit")
+        raise HTTPException(
+            status_code=429,
+            detail="All sender mailboxes are at their per-minute limit",
+            headers={"Retry-After": str(max(1, math.ceil(min(waits))))}
+        )
+
+    def send(self, to_email, subject, body):
+        """Send through the pool; returns the sending mailbox address
+
+        The quota slot is given back if the mailbox can't be resolved or the
+        SMTP send fails.
+        """
+        mailbox, reservation = self.acquire()
+        try:
+            smtp_server, smtp_port = mailbox.smtp
+            send_notification_email(
+                to_email, subject, body, smtp_server,
+                username=mailbox.email, password=mailbox.password, smtp_port=smtp_port
+            )
+        except Exception:
+            self.store.refund(reservation)
+            raise
+        return mailbox.email
+
+    def stats(self):
+        usage = self.store.usage(self.mailboxes, time.time())
+        return [mailbox.stats(usage[mailbox.email]) for mailbox in self.mailboxes]